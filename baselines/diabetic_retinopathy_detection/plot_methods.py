@@ -56,6 +56,12 @@ flags.mark_flag_as_required('distribution_shift')
 # Metric flags.
 flags.DEFINE_integer('num_bins', 15, 'Number of bins for ECE.')
 
+# Loading flags.
+flags.DEFINE_bool(
+    'mmap_eval_results', False,
+    'Whether to memory-map the stored numeric arrays of locally stored '
+    'results, rather than reading every array into memory up front.')
+
 FLAGS = flags.FLAGS
 
 
@@ -107,7 +113,8 @@ def main(argv):
       for seed in seeds:
         key = (model_type, k, is_deterministic, tuning_domain, num_mc_samples)
         eval_results = utils.load_eval_results(
-            eval_results_dir=dataset_subdir_path, epoch=seed)
+            eval_results_dir=dataset_subdir_path, epoch=seed,
+            mmap_mode='r' if FLAGS.mmap_eval_results else None)
 
         for arr_name, arr in eval_results.items():
           if arr.ndim > 0 and arr.shape[0] > 1:
@@ -387,13 +387,14 @@ def main(argv):
           # Logits dimension is (num_samples, batch_size).
           logits_list = tf.stack(logits_list, axis=0)
 
-          probs_list = tf.nn.sigmoid(logits_list)
-          probs = tf.reduce_mean(probs_list, axis=0)
+          # Logits of the MC predictive mean, computed in the log domain.
+          mean_logits = utils.get_mc_predictive_mean_logits(logits_list)
           negative_log_likelihood = tf.reduce_mean(
               batch_loss_fn(
                   y_true=tf.expand_dims(labels, axis=-1),
-                  y_pred=probs,
-                  from_logits=False))
+                  y_pred=mean_logits,
+                  from_logits=True))
+          probs = tf.nn.sigmoid(mean_logits)
         else:
           # Single train step
           logits = model(images, training=True)
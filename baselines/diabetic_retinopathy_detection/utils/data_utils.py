@@ -25,10 +25,16 @@
 # pylint: disable=missing-function-docstring
 import logging
 
+import tensorflow as tf
 import tensorflow_datasets as tfds
 
 import uncertainty_baselines as ub
 
+# The dataset builders default to a fixed 64 parser threads. The test splits
+# are only decoded at evaluation time, where the image decoding is usually the
+# bottleneck, so let tf.data tune the parallelism to the host instead.
+_TEST_NUM_PARALLEL_PARSER_CALLS = tf.data.experimental.AUTOTUNE
+
 
 def load_kaggle_severity_shift_dataset(train_batch_size,
                                        eval_batch_size,
@@ -109,13 +115,18 @@ def load_kaggle_severity_shift_dataset(train_batch_size,
       f'diabetic_retinopathy_severity_shift_{flags.dr_decision_threshold}')
   split_to_dataset = {}
   for split in splits_to_return:
+    builder_kwargs = {}
+    if split in ('in_domain_test', 'ood_test'):
+      builder_kwargs['num_parallel_parser_calls'] = (
+          _TEST_NUM_PARALLEL_PARSER_CALLS)
     dataset_builder = ub.datasets.get(
         dataset_name,
         split=split,
         data_dir=data_dir,
         cache=(flags.cache_eval_datasets and split != 'train'),
         drop_remainder=not load_for_eval,
-        builder_config=f'{dataset_name}/{flags.preproc_builder_config}')
+        builder_config=f'{dataset_name}/{flags.preproc_builder_config}',
+        **builder_kwargs)
     dataset = dataset_builder.load(batch_size=split_to_batch_size[split])
 
     if strategy is not None:
@@ -247,7 +258,8 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
         decision_threshold=flags.dr_decision_threshold,
         cache=flags.cache_eval_datasets,
         drop_remainder=not load_for_eval,
-        builder_config=f'{dr_dataset_name}/{flags.preproc_builder_config}')
+        builder_config=f'{dr_dataset_name}/{flags.preproc_builder_config}',
+        num_parallel_parser_calls=_TEST_NUM_PARALLEL_PARSER_CALLS)
     dataset_test = dataset_test_builder.load(batch_size=eval_batch_size)
     if strategy is not None:
       dataset_test = strategy.experimental_distribute_dataset(dataset_test)
@@ -262,7 +274,8 @@ def load_kaggle_aptos_country_shift_dataset(train_batch_size,
         decision_threshold=flags.dr_decision_threshold,
         cache=flags.cache_eval_datasets,
         drop_remainder=not load_for_eval,
-        builder_config=f'aptos/{flags.preproc_builder_config}')
+        builder_config=f'aptos/{flags.preproc_builder_config}',
+        num_parallel_parser_calls=_TEST_NUM_PARALLEL_PARSER_CALLS)
     dataset_ood_test = aptos_test_builder.load(batch_size=eval_batch_size)
     if strategy is not None:
       dataset_ood_test = strategy.experimental_distribute_dataset(
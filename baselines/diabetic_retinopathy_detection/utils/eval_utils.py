@@ -36,7 +36,6 @@ from sklearn.metrics import log_loss
 from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import roc_auc_score
 from sklearn.metrics import roc_curve
-from sklearn.preprocessing import LabelBinarizer
 from sklearn.utils import check_array
 from sklearn.utils import check_consistent_length
 import tensorflow as tf
@@ -416,23 +415,31 @@ def evaluate_model_on_datasets_np(
   # e.g., joint_test = in_domain_test UNION ood_test
   dataset_split_to_containers = {}
 
+  # Map from container key to the per-batch estimator output it stores.
+  container_to_output_key = {
+      'y_pred': 'prediction',
+      'y_pred_entropy': 'predictive_entropy',
+  }
+  if not is_deterministic:
+    container_to_output_key.update({
+        'y_pred_variance': 'predictive_variance',
+        'y_aleatoric_uncert': 'aleatoric_uncertainty',
+        'y_epistemic_uncert': 'epistemic_uncertainty',
+    })
+
   for dataset_split, dataset in datasets.items():
     # Containers for numpy storage of
-    # image names, predictions, ground truth, uncertainty estimates
-    names = list()
-    y_true = list()
-    y_pred = list()
-    y_pred_entropy = list()
-
-    if not is_deterministic:
-      y_pred_variance = list()
-      y_aleatoric_uncert = list()
-      y_epistemic_uncert = list()
+    # image names, predictions, ground truth, uncertainty estimates.
+    # These are preallocated to the full split size on the first batch and
+    # filled in place, rather than growing lists that are concatenated after.
+    dataset_steps = steps[dataset_split]
+    dataset_size = dataset_steps * eval_batch_size
+    containers = {}
+    offset = 0
 
     # Begin iteration for this dataset split
     start_time = time.time()
     dataset_iterator = iter(dataset)
-    dataset_steps = steps[dataset_split]
     logging.info(f'Evaluating split {dataset_split}.')
     for step in range(dataset_steps):
       if step % 10 == 0:
@@ -451,40 +458,32 @@ def evaluate_model_on_datasets_np(
           **estimator_args)
 
       # Add this batch of predictions to the containers
-      names.append(inputs['name'])
-      y_true.append(labels.numpy())
-      y_pred.append(pred_and_uncert['prediction'])
-      y_pred_entropy.append(pred_and_uncert['predictive_entropy'])
-      if not is_deterministic:
-        y_pred_variance.append(pred_and_uncert['predictive_variance'])
-        y_aleatoric_uncert.append(pred_and_uncert['aleatoric_uncertainty'])
-        y_epistemic_uncert.append(pred_and_uncert['epistemic_uncertainty'])
+      batch_outputs = {'names': inputs['name'], 'y_true': labels}
+      for container_key, output_key in container_to_output_key.items():
+        batch_outputs[container_key] = pred_and_uncert[output_key]
+
+      for container_key, batch_output in batch_outputs.items():
+        batch_output = np.asarray(batch_output).reshape(-1)
+        if container_key not in containers:
+          containers[container_key] = np.empty(
+              dataset_size, dtype=batch_output.dtype)
+        batch_size = batch_output.shape[0]
+        containers[container_key][offset:offset + batch_size] = batch_output
+      offset += batch_size
 
     # Update metadata
     time_elapsed = time.time() - start_time
     dataset_split_to_containers[dataset_split] = {}
     dataset_split_dict = dataset_split_to_containers[dataset_split]
     dataset_split_dict['total_ms_elapsed'] = time_elapsed * 1e6
-    dataset_split_dict['dataset_size'] = dataset_steps * eval_batch_size
+    dataset_split_dict['dataset_size'] = dataset_size
 
-    dataset_split_dict['names'] = np.concatenate(names).flatten()
-    dataset_split_dict['y_true'] = np.concatenate(y_true).flatten()
-    dataset_split_dict['y_pred'] = np.concatenate(y_pred).flatten()
+    # Use vectorized NumPy containers, trimmed to the examples seen
+    for container_key, container in containers.items():
+      dataset_split_dict[container_key] = container[:offset]
     dataset_split_dict['y_pred'] = dataset_split_dict['y_pred'].astype(
         'float64')
 
-    # Use vectorized NumPy containers
-    dataset_split_dict['y_pred_entropy'] = (
-        np.concatenate(y_pred_entropy).flatten())
-
-    if not is_deterministic:
-      dataset_split_dict['y_pred_variance'] = (
-          np.concatenate(y_pred_variance).flatten())
-      dataset_split_dict['y_aleatoric_uncert'] = (
-          np.concatenate(y_aleatoric_uncert).flatten())
-      dataset_split_dict['y_epistemic_uncert'] = (
-          np.concatenate(y_epistemic_uncert).flatten())
-
   # Add Joint Dicts
   dataset_split_to_containers = results_storage_utils.add_joint_dicts(
       dataset_split_to_containers, is_deterministic=is_deterministic)
@@ -669,6 +668,11 @@ def compute_loss_and_accuracy_arrs(results):
 def compute_log_loss_arr(results, labels=np.asarray([0, 1]), eps=1e-15):
   """Based on sklearn.preprocessing.log_loss, no aggregation.
 
+  Computes the per-example binary NLL directly from the sigmoid
+  probabilities, using log1p for the negative class, rather than building
+  one-hot labels and a renormalized [1 - p, p] matrix. As before, `y_pred`
+  may also be shaped [N, 1], or [N, 2] with the probabilities of both classes.
+
   Args:
     results: Dict, evaluation results for a single dataset.
     labels: np.ndarray, binary classification task labels.
@@ -681,57 +685,34 @@ def compute_log_loss_arr(results, labels=np.asarray([0, 1]), eps=1e-15):
   y_pred = check_array(y_pred, ensure_2d=False)
   check_consistent_length(y_pred, y_true, None)
 
-  lb = LabelBinarizer()
-
-  if labels is not None:
-    lb.fit(labels)
-  else:
-    lb.fit(y_true)
-
-  if len(lb.classes_) == 1:
+  classes = np.unique(y_true if labels is None else labels)
+  if len(classes) != 2:
     if labels is None:
       raise ValueError('y_true contains only one label ({0}). Please '
                        'provide the true labels explicitly through the '
-                       'labels argument.'.format(lb.classes_[0]))
+                       'labels argument.'.format(classes))
     else:
-      raise ValueError('The labels array needs to contain at least two '
-                       'labels for log_loss, '
-                       'got {0}.'.format(lb.classes_))
-
-  transformed_labels = lb.transform(y_true)
-
-  if transformed_labels.shape[1] == 1:
-    transformed_labels = np.append(
-        1 - transformed_labels, transformed_labels, axis=1)
+      raise ValueError('The labels array needs to contain exactly two '
+                       'labels for binary log_loss, '
+                       'got {0}.'.format(classes))
+  if y_pred.ndim == 2 and y_pred.shape[1] == 1:
+    y_pred = y_pred[:, 0]
+  if y_pred.ndim == 2 and y_pred.shape[1] != 2:
+    raise ValueError('The number of classes in labels is different '
+                     'from that in y_pred. Classes found in '
+                     'labels: {0}'.format(classes))
+
+  # The larger label is the positive class, as in sklearn's LabelBinarizer.
+  is_positive = y_true == classes[1]
 
   # Clipping
   y_pred = np.clip(y_pred, eps, 1 - eps)
-
-  # If y_pred is of single dimension, assume y_true to be binary
-  # and then check.
   if y_pred.ndim == 1:
-    y_pred = y_pred[:, np.newaxis]
-  if y_pred.shape[1] == 1:
-    y_pred = np.append(1 - y_pred, y_pred, axis=1)
-
-  # Check if dimensions are consistent.
-  transformed_labels = check_array(transformed_labels)
-  if len(lb.classes_) != y_pred.shape[1]:
-    if labels is None:
-      raise ValueError('y_true and y_pred contain different number of '
-                       'classes {0}, {1}. Please provide the true '
-                       'labels explicitly through the labels argument. '
-                       'Classes found in '
-                       'y_true: {2}'.format(transformed_labels.shape[1],
-                                            y_pred.shape[1], lb.classes_))
-    else:
-      raise ValueError('The number of classes in labels is different '
-                       'from that in y_pred. Classes found in '
-                       'labels: {0}'.format(lb.classes_))
-
-  # Renormalize
-  y_pred /= y_pred.sum(axis=1)[:, np.newaxis]
-  loss = -(transformed_labels * np.log(y_pred)).sum(axis=1)
+    loss = -np.where(is_positive, np.log(y_pred), np.log1p(-y_pred))
+  else:
+    # Renormalize the [negative, positive] class probabilities.
+    loss = -np.log(
+        np.where(is_positive, y_pred[:, 1], y_pred[:, 0]) / y_pred.sum(axis=1))
   results['nll_arr'] = loss
   return results
 
@@ -1254,14 +1235,13 @@ def compute_retention_curve_on_accuracies(
   accuracies = accuracies[uncertainty_order]
   retention_arr = np.zeros(n_objects + 1)
 
-  for i in range(1, n_objects):
-    accuracy_i = accuracies[:i].sum()
+  # Entry i holds the number of correct predictions among the i most certain
+  # points; a single cumulative sum gives all of these at once.
+  retention_arr[1:n_objects] = np.cumsum(accuracies)[:n_objects - 1]
 
-    if use_oracle:
-      j = n_objects - i
-      accuracy_i += j
-
-    retention_arr[i] = accuracy_i
+  if use_oracle:
+    # The oracle is correct on the remaining j = n_objects - i points.
+    retention_arr[1:n_objects] += n_objects - np.arange(1, n_objects)
 
   # With oracle:
   # * Divide by total number of predictions
@@ -0,0 +1,158 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the evaluation utils."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+from utils import eval_utils  # local file import from baselines.diabetic_retinopathy_detection
+
+
+def _sklearn_log_loss_arr(y_pred, y_true, eps=1e-15):
+  """Unaggregated sklearn log_loss, on one-hot labels and [1 - p, p]."""
+  transformed_labels = np.eye(2)[y_true]
+  y_pred = np.clip(y_pred, eps, 1 - eps)
+  if y_pred.ndim == 1:
+    y_pred = y_pred[:, np.newaxis]
+  if y_pred.shape[1] == 1:
+    y_pred = np.append(1 - y_pred, y_pred, axis=1)
+  y_pred /= y_pred.sum(axis=1)[:, np.newaxis]
+  return -(transformed_labels * np.log(y_pred)).sum(axis=1)
+
+
+def _loop_retention_curve(accuracies, uncertainty, use_oracle):
+  """Retention curve, computed one retention threshold at a time."""
+  n_objects = accuracies.shape[0]
+  accuracies = accuracies[uncertainty.argsort()]
+  retention_arr = np.zeros(n_objects + 1)
+  for i in range(1, n_objects):
+    accuracy_i = accuracies[:i].sum()
+    if use_oracle:
+      accuracy_i += n_objects - i
+    retention_arr[i] = accuracy_i
+  normalizer = eval_utils.get_retention_curve_normalizer(use_oracle, n_objects)
+  retention_arr[0] = n_objects if use_oracle else 1
+  retention_arr[-1] = accuracies.sum()
+  return retention_arr[::-1] / normalizer
+
+
+def _estimator(images):
+  return 1. / (1. + np.exp(-images.sum(axis=1, keepdims=True)))
+
+
+def _uncertainty_estimator_fn(images, estimator, training_setting):
+  del training_setting
+  prediction = estimator(images)
+  return {
+      'prediction': prediction,
+      'predictive_entropy': 1. - prediction,
+      'predictive_variance': prediction**2,
+      'aleatoric_uncertainty': 2. * prediction,
+      'epistemic_uncertainty': 3. * prediction,
+  }
+
+
+class EvalUtilsTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(('1d', (-1,)), ('n_by_1', (-1, 1)))
+  def test_compute_log_loss_arr(self, shape):
+    probs = np.array(
+        [0., 1e-20, 1e-7, 0.1, 0.5, 0.9, 1 - 1e-7, 1 - 1e-12, 1.])
+    y_pred = np.concatenate([probs, probs]).reshape(shape)
+    y_true = np.repeat([0, 1], len(probs))
+    results = eval_utils.compute_log_loss_arr(
+        {'y_pred': y_pred, 'y_true': y_true})
+    np.testing.assert_allclose(
+        results['nll_arr'], _sklearn_log_loss_arr(y_pred, y_true), rtol=1e-6)
+
+  def test_compute_log_loss_arr_both_classes(self):
+    rng = np.random.RandomState(0)
+    y_pred = rng.uniform(size=(20, 2))
+    y_pred[:2] = [[1., 1e-20], [1e-20, 1.]]
+    y_true = rng.randint(2, size=20)
+    results = eval_utils.compute_log_loss_arr(
+        {'y_pred': y_pred, 'y_true': y_true})
+    np.testing.assert_allclose(
+        results['nll_arr'], _sklearn_log_loss_arr(y_pred, y_true), rtol=1e-6)
+
+  def test_compute_log_loss_arr_invalid_shape(self):
+    results = {
+        'y_pred': np.full((4, 3), 1. / 3),
+        'y_true': np.array([0, 1, 1, 0]),
+    }
+    with self.assertRaisesRegex(ValueError, 'number of classes'):
+      eval_utils.compute_log_loss_arr(results)
+
+  @parameterized.parameters(False, True)
+  def test_compute_retention_curve_on_accuracies(self, use_oracle):
+    # 37 examples is not a multiple of any retention grid, and rounding the
+    # uncertainties produces many ties.
+    rng = np.random.RandomState(0)
+    accuracies = rng.randint(2, size=37).astype(np.float64)
+    uncertainty = np.round(rng.uniform(size=37), 1)
+    retention_curve = eval_utils.compute_retention_curve_on_accuracies(
+        accuracies, uncertainty, use_oracle=use_oracle)
+    np.testing.assert_allclose(
+        retention_curve,
+        _loop_retention_curve(accuracies, uncertainty, use_oracle))
+
+  @parameterized.parameters(False, True)
+  def test_evaluate_model_on_datasets_np_partial_last_batch(
+      self, is_deterministic):
+    # 10 examples in batches of 4, so the last of the 3 batches is partial.
+    features = np.random.RandomState(0).normal(size=(10, 3)).astype(np.float32)
+    labels = np.arange(10) % 2
+    names = np.array([f'{i}.jpeg'.encode() for i in range(10)], dtype=object)
+    dataset = tf.data.Dataset.from_tensor_slices({
+        'features': features,
+        'labels': labels,
+        'name': names,
+    }).batch(4)
+    dataset_split_to_containers = eval_utils.evaluate_model_on_datasets_np(
+        datasets={'in_domain_test': dataset},
+        steps={'in_domain_test': 3},
+        estimator=_estimator,
+        estimator_args={},
+        uncertainty_estimator_fn=_uncertainty_estimator_fn,
+        eval_batch_size=4,
+        is_deterministic=is_deterministic,
+        np_input=True)
+    dataset_split_dict = dataset_split_to_containers['in_domain_test']
+
+    expected = _uncertainty_estimator_fn(
+        features, _estimator, training_setting=False)
+    np.testing.assert_array_equal(dataset_split_dict['names'], names)
+    expected_containers = {
+        'y_true': labels,
+        'y_pred': expected['prediction'],
+        'y_pred_entropy': expected['predictive_entropy'],
+    }
+    if not is_deterministic:
+      expected_containers.update({
+          'y_pred_variance': expected['predictive_variance'],
+          'y_aleatoric_uncert': expected['aleatoric_uncertainty'],
+          'y_epistemic_uncert': expected['epistemic_uncertainty'],
+      })
+    for container_key, expected_container in expected_containers.items():
+      np.testing.assert_allclose(
+          dataset_split_dict[container_key], expected_container.flatten(),
+          rtol=1e-6)
+    self.assertEqual(dataset_split_dict['y_pred'].dtype, np.float64)
+
+
+if __name__ == '__main__':
+  absltest.main()
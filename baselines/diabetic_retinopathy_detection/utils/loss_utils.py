@@ -90,6 +90,28 @@ def get_positive_empirical_prob(labels: tf.Tensor) -> float:
   return n_pos_labels / total_n_labels
 
 
+def get_mc_predictive_mean_logits(logits: tf.Tensor, axis: int = 0):
+  r"""Logits of the predictive mean sigmoid probability over MC samples.
+
+  For the predictive mean p = 1/S \sum_s sigmoid(z_s), we have
+    log p = logsumexp_s(log_sigmoid(z_s)) - log S, and
+    log (1 - p) = logsumexp_s(log_sigmoid(-z_s)) - log S,
+  so the logit of p is the difference of the two logsumexp terms. This fuses
+  the sigmoid and the mean over samples in the log domain, so that the loss
+  can be computed with `from_logits=True` rather than from clipped
+  probabilities.
+
+  Args:
+    logits: tf.Tensor, logits of the Monte Carlo samples.
+    axis: int, the sample axis.
+
+  Returns:
+    tf.Tensor, logits of the predictive mean, with `axis` reduced.
+  """
+  return (tf.reduce_logsumexp(tf.math.log_sigmoid(logits), axis=axis) -
+          tf.reduce_logsumexp(tf.math.log_sigmoid(-logits), axis=axis))
+
+
 def get_weighted_binary_cross_entropy_keras(weights: Dict[int, float]):
   """Return a function to calculate weighted binary xent with multi-hot labels.
 
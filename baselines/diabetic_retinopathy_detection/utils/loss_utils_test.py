@@ -0,0 +1,41 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the loss utils."""
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+from utils import loss_utils  # local file import from baselines.diabetic_retinopathy_detection
+
+
+class LossUtilsTest(tf.test.TestCase, parameterized.TestCase):
+
+  @parameterized.parameters((1, 4), (5, 4, 1), (16, 3))
+  def test_get_mc_predictive_mean_logits(self, *shape):
+    rng = np.random.RandomState(0)
+    logits = rng.normal(scale=5., size=shape)
+    # Extreme logits, where the sigmoid saturates.
+    logits.reshape(shape[0], -1)[:, 0] = 50.
+    logits.reshape(shape[0], -1)[:, 1] = -50.
+    mean_logits = loss_utils.get_mc_predictive_mean_logits(
+        tf.constant(logits, dtype=tf.float64))
+    self.assertEqual(mean_logits.shape, shape[1:])
+    expected_log_probs = np.log(np.mean(1. / (1. + np.exp(-logits)), axis=0))
+    self.assertAllClose(tf.math.log_sigmoid(mean_logits), expected_log_probs)
+
+
+if __name__ == '__main__':
+  tf.test.main()
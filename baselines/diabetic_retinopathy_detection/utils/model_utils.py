@@ -28,6 +28,7 @@ import os
 import pickle
 from typing import List, NamedTuple
 
+import numpy as np
 import tensorflow as tf
 
 # pylint: disable=g-import-not-at-top
@@ -165,15 +166,28 @@ def get_latest_checkpoint(file_names, return_epoch=False):
     return most_recent_checkpoint_epoch_and_file_name[1]
 
 
-def load_keras_model(checkpoint):
+def load_keras_model(checkpoint, for_inference=False):
   """Loads a Keras model from a checkpoint directory.
 
   Args:
    checkpoint: str, checkpoint directory.
+   for_inference: bool, if True, load the SavedModel with
+     `tf.saved_model.load` instead of rebuilding the full Keras model. The
+     restored object can be called as `model(inputs, training=...)` with its
+     already-traced graphs, which is faster to load and lighter in host
+     memory, but it exposes no Keras API (e.g., it cannot be trained).
 
   Returns:
-    tf.keras.Model
+    tf.keras.Model, or the restored SavedModel object if `for_inference`.
   """
+  if for_inference:
+    model = tf.saved_model.load(checkpoint)
+    logging.info('Successfully loaded SavedModel from checkpoint %s.',
+                 checkpoint)
+    logging.info('Model number of weights: %s',
+                 sum(int(np.prod(v.shape)) for v in model.variables))
+    return model
+
   model = tf.keras.models.load_model(checkpoint, compile=False)
   logging.info('Successfully loaded model from checkpoint %s.', checkpoint)
   logging.info('Model input shape: %s', model.input_shape)
@@ -221,7 +235,8 @@ def load_all_keras_checkpoints(checkpoint_dir):
 
 def load_keras_checkpoints(checkpoint_dir,
                            load_ensemble=False,
-                           return_epoch=True):
+                           return_epoch=True,
+                           for_inference=False):
   """Main checkpoint loading function.
 
   When not loading an ensemble, defaults to also return the epoch
@@ -232,6 +247,8 @@ def load_keras_checkpoints(checkpoint_dir,
     load_ensemble: bool, loads all checkpoints in the directory.
     return_epoch: bool, if only returning a single model, also return the epoch
       for that model checkpoint.
+    for_inference: bool, load the models for inference only; see
+      `load_keras_model`.
 
   Raises:
     Exception: if no checkpoint found.
@@ -246,17 +263,22 @@ def load_keras_checkpoints(checkpoint_dir,
   if load_ensemble:
     model = []
     for checkpoint_file in checkpoint_filenames:
-      model.append(load_keras_model(checkpoint=checkpoint_file))
+      model.append(load_keras_model(
+          checkpoint=checkpoint_file, for_inference=for_inference))
   else:
     if len(checkpoint_filenames) == 1 and not return_epoch:
-      return load_keras_model(checkpoint_filenames[0])
+      return load_keras_model(
+          checkpoint_filenames[0], for_inference=for_inference)
     latest_checkpoint = get_latest_checkpoint(
         file_names=checkpoint_filenames, return_epoch=return_epoch)
     if return_epoch:
       epoch, latest_checkpoint = latest_checkpoint
-      model = (epoch, load_keras_model(checkpoint=latest_checkpoint))
+      model = (epoch,
+               load_keras_model(
+                   checkpoint=latest_checkpoint, for_inference=for_inference))
     else:
-      model = load_keras_model(checkpoint=latest_checkpoint)
+      model = load_keras_model(
+          checkpoint=latest_checkpoint, for_inference=for_inference)
 
   return model
 
@@ -780,7 +780,12 @@ def read_eval_folder(path, allow_pickle=True):
   for fn in filenames:
     p = os.path.join(path, fn)
     with tf.io.gfile.GFile(p, 'rb') as f:
-      d[fn[:-4]] = np.load(f, allow_pickle=allow_pickle)
+      if fn.endswith('.npz'):
+        # All arrays stored in a single archive, see `store_eval_results`.
+        with np.load(f, allow_pickle=allow_pickle) as archive:
+          d.update({key: archive[key] for key in archive.files})
+      else:
+        d[fn[:-4]] = np.load(f, allow_pickle=allow_pickle)
   return d
 
 
@@ -38,6 +38,15 @@ import pandas as pd
 import tensorflow as tf
 from tqdm import tqdm
 
+# File name used when all per-prediction arrays are stored in one archive.
+EVAL_RESULTS_ARCHIVE = 'eval_results.npz'
+
+
+def _get_eval_results_file_name(key):
+  # File name of an array stored in its own file. Archive entries are keyed
+  # by `key`, and filtered on this name, so that both layouts load the same.
+  return f'{key}.npy'
+
 JOINT_SPLIT_TO_CONSTITUENT_SPLITS = {
     'joint_validation': ['in_domain_validation', 'ood_validation'],
     'joint_test': ['in_domain_test', 'ood_test']
@@ -85,7 +94,8 @@ def save_per_prediction_results(output_dir,
                                 epoch,
                                 per_prediction_results,
                                 verbose=True,
-                                allow_overwrite=True):
+                                allow_overwrite=True,
+                                single_file=False):
   for dataset_key, results_dict in per_prediction_results.items():
     if verbose:
       logging.info(
@@ -97,7 +107,8 @@ def save_per_prediction_results(output_dir,
         dataset_output_dir,
         results_dict,
         epoch=epoch,
-        allow_overwrite=allow_overwrite)
+        allow_overwrite=allow_overwrite,
+        single_file=single_file)
 
 
 def add_joint_dicts(dataset_split_containers: Dict[str, Dict],
@@ -250,11 +261,18 @@ def store_eval_metadata(eval_results_dir,
 def store_eval_results(eval_results_dir,
                        dict_of_lists,
                        epoch=None,
-                       allow_overwrite=True):
+                       allow_overwrite=True,
+                       single_file=False):
   """Store image names, predictions, ground truth, uncertainty estimates,
 
   and optionally, an array with binary indicators of whether or not the
   prediction is OOD (`is_ood`).
+
+  By default each array is written to its own `.npy` file. With
+  `single_file=True`, all arrays are instead written to a single
+  `EVAL_RESULTS_ARCHIVE` `.npz` file, which avoids many small writes (and
+  later, reads) against remote filesystems such as GCS. `load_eval_results`
+  reads either layout.
   """
 
   if epoch is None:
@@ -267,33 +285,100 @@ def store_eval_results(eval_results_dir,
   tf.io.gfile.makedirs(eval_results_dir)
   assert tf.io.gfile.isdir(eval_results_dir)
 
-  for key, arr in dict_of_lists.items():
-    np_eval_results_path = os.path.join(eval_results_dir, f'{key}.npy')
+  eval_results = {key: np.array(arr) for key, arr in dict_of_lists.items()}
+  if single_file:
+    file_names = [EVAL_RESULTS_ARCHIVE]
+  else:
+    file_names = [_get_eval_results_file_name(key) for key in eval_results]
+
+  for file_name in file_names:
+    np_eval_results_path = os.path.join(eval_results_dir, file_name)
     if not allow_overwrite and tf.io.gfile.exists(np_eval_results_path):
       raise ValueError(f'The file {np_eval_results_path} exists already!!!')
-    with tf.io.gfile.GFile(np_eval_results_path, 'w') as f:
-      np.save(f, np.array(arr))
+
+  if single_file:
+    with tf.io.gfile.GFile(
+        os.path.join(eval_results_dir, EVAL_RESULTS_ARCHIVE), 'wb') as f:
+      np.savez(f, **eval_results)
+  else:
+    for key, arr in eval_results.items():
+      np_eval_results_path = os.path.join(eval_results_dir,
+                                          _get_eval_results_file_name(key))
+      with tf.io.gfile.GFile(np_eval_results_path, 'w') as f:
+        np.save(f, arr)
 
   logging.info(f'Stored eval results to {eval_results_dir}')
 
 
-def load_eval_results(eval_results_dir, epoch=None, name_filter=None):
+def load_eval_results(eval_results_dir,
+                      epoch=None,
+                      name_filter=None,
+                      mmap_mode=None):
+  """Load the per-prediction arrays stored by `store_eval_results`.
+
+  Args:
+    eval_results_dir: str, directory containing the `eval_results*` folders.
+    epoch: Optional[int], epoch (or eval seed) of the results to load.
+    name_filter: Optional[Callable], predicate on file names to load.
+    mmap_mode: Optional[str], if set (e.g., 'r') and the results live on a
+      local filesystem, memory-map numeric arrays instead of reading them into
+      memory. Arrays holding Python objects (e.g., image names), and results
+      on remote filesystems such as GCS, are read in full as usual. So are
+      the arrays of an `EVAL_RESULTS_ARCHIVE`.
+
+  Returns:
+    Dict[str, np.ndarray], arrays keyed by file name (without extension).
+
+  Raises:
+    ValueError: if the directory holds neither an `EVAL_RESULTS_ARCHIVE` nor
+      per-array `.npy` files.
+  """
   if epoch is None:
     eval_results_name = 'eval_results'
   else:
     eval_results_name = f'eval_results_{epoch}'
 
   eval_results_dir = os.path.join(eval_results_dir, eval_results_name)
+  use_mmap = mmap_mode is not None and '://' not in eval_results_dir
 
-  arr_names = tf.io.gfile.listdir(eval_results_dir)
+  arr_names = []
+  if tf.io.gfile.isdir(eval_results_dir):
+    arr_names = tf.io.gfile.listdir(eval_results_dir)
+  if not any(arr_name == EVAL_RESULTS_ARCHIVE or arr_name.endswith('.npy')
+             for arr_name in arr_names):
+    raise ValueError(
+        f'Found neither {EVAL_RESULTS_ARCHIVE} nor .npy eval results in '
+        f'{eval_results_dir}.')
   if name_filter:
-    arr_names = list(filter(name_filter, arr_names))
+    arr_names = [
+        arr_name for arr_name in arr_names
+        if arr_name == EVAL_RESULTS_ARCHIVE or name_filter(arr_name)
+    ]
   eval_results = {}
   for arr_name in arr_names:
     np_eval_results_path = os.path.join(eval_results_dir, arr_name)
-    with tf.io.gfile.GFile(np_eval_results_path, 'rb') as f:
-      arr = np.load(f, allow_pickle=True)
-      eval_results[arr_name.split('.')[0]] = arr
+    if arr_name == EVAL_RESULTS_ARCHIVE:
+      with tf.io.gfile.GFile(np_eval_results_path, 'rb') as f:
+        with np.load(f, allow_pickle=True) as archive:
+          for key in archive.files:
+            if name_filter and not name_filter(
+                _get_eval_results_file_name(key)):
+              continue
+            eval_results[key] = archive[key]
+      continue
+
+    arr = None
+    if use_mmap:
+      try:
+        arr = np.load(
+            np_eval_results_path, mmap_mode=mmap_mode, allow_pickle=True)
+      except ValueError:
+        # Object arrays cannot be memory-mapped.
+        arr = None
+    if arr is None:
+      with tf.io.gfile.GFile(np_eval_results_path, 'rb') as f:
+        arr = np.load(f, allow_pickle=True)
+    eval_results[arr_name.split('.')[0]] = arr
 
   logging.info(f'Loaded eval results from {eval_results_dir}')
   return eval_results
@@ -0,0 +1,76 @@
+# coding=utf-8
+# Copyright 2022 The Uncertainty Baselines Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for storing and loading the per-prediction eval results."""
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from utils import results_storage_utils  # local file import from baselines.diabetic_retinopathy_detection
+
+
+def _get_eval_results():
+  return {
+      'y_pred': np.array([0.1, 0.7, 0.4], dtype=np.float32),
+      'y_true': np.array([0, 1, 1], dtype=np.int32),
+      'names': np.array(['a.jpeg', 'b.jpeg', 'c.jpeg'], dtype=object),
+  }
+
+
+class ResultsStorageUtilsTest(parameterized.TestCase):
+
+  @parameterized.parameters((False, None), (False, 'r'), (True, None),
+                            (True, 'r'))
+  def test_store_load_eval_results(self, single_file, mmap_mode):
+    eval_results_dir = self.create_tempdir().full_path
+    eval_results = _get_eval_results()
+    results_storage_utils.store_eval_results(
+        eval_results_dir, eval_results, epoch=3, single_file=single_file)
+    loaded_eval_results = results_storage_utils.load_eval_results(
+        eval_results_dir, epoch=3, mmap_mode=mmap_mode)
+    self.assertCountEqual(loaded_eval_results.keys(), eval_results.keys())
+    for key, arr in eval_results.items():
+      np.testing.assert_array_equal(loaded_eval_results[key], arr)
+    if mmap_mode is not None and not single_file:
+      self.assertIsInstance(loaded_eval_results['y_pred'], np.memmap)
+      # Arrays of Python objects cannot be memory-mapped.
+      self.assertNotIsInstance(loaded_eval_results['names'], np.memmap)
+
+  @parameterized.parameters(False, True)
+  def test_load_eval_results_name_filter(self, single_file):
+    eval_results_dir = self.create_tempdir().full_path
+    results_storage_utils.store_eval_results(
+        eval_results_dir, _get_eval_results(), single_file=single_file)
+    loaded_eval_results = results_storage_utils.load_eval_results(
+        eval_results_dir, name_filter=lambda name: name.startswith('y_'))
+    self.assertCountEqual(loaded_eval_results.keys(), ['y_pred', 'y_true'])
+
+  def test_store_eval_results_no_overwrite(self):
+    eval_results_dir = self.create_tempdir().full_path
+    results_storage_utils.store_eval_results(
+        eval_results_dir, _get_eval_results(), single_file=True)
+    with self.assertRaises(ValueError):
+      results_storage_utils.store_eval_results(
+          eval_results_dir, _get_eval_results(), allow_overwrite=False,
+          single_file=True)
+
+  def test_load_eval_results_missing(self):
+    eval_results_dir = self.create_tempdir().full_path
+    with self.assertRaisesRegex(ValueError, 'Found neither'):
+      results_storage_utils.load_eval_results(eval_results_dir, epoch=0)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -33,7 +33,6 @@ TODO(nband): better use TensorArrays in TF methods for faster TPU execution.
 # pylint: disable=logging-format-interpolation
 # pylint: disable=logging-fstring-interpolation
 # pylint: disable=missing-function-docstring
-import functools
 
 import jax
 import jax.numpy as jnp
@@ -126,6 +125,24 @@ def predict_and_decompose_uncertainty_tf(mc_samples: tf.Tensor):
   }
 
 
+def _stack_samples_to_np(samples, batch_size):
+  """Stacks per-member (or per-sample) predictions and copies them to host.
+
+  Ensemble members wrapped with `numpy_outputs=False` return device tensors;
+  stacking them before the conversion means the whole [S, B] block is moved
+  to host in a single transfer rather than once per member.
+
+  Args:
+    samples: list of `tf.Tensor` or `np.ndarray` sigmoid probabilities, each
+      with B elements.
+    batch_size: int, the batch size B.
+
+  Returns:
+    `np.ndarray`, samples with shape [S, B].
+  """
+  return np.asarray(tf.reshape(tf.stack(samples), [-1, batch_size]))
+
+
 def predict_and_decompose_uncertainty_np(mc_samples: np.ndarray):
   """Using a set of MC samples, produce the prediction and uncertainty
 
@@ -295,11 +312,11 @@ def variational_ensemble_predict_and_decompose_uncertainty_np(
   # test time from different models
   # See note in docstring regarding `training` mode
   # pylint: disable=g-complex-comprehension
-  mc_samples = np.asarray([
+  mc_samples = _stack_samples_to_np([
       model(x, training=training_setting)
       for _ in range(num_samples)
       for model in models
-  ]).reshape(-1, b)
+  ], b)
   # pylint: enable=g-complex-comprehension
 
   return predict_and_decompose_uncertainty_np(mc_samples=mc_samples)
@@ -462,8 +479,8 @@ def deep_ensemble_predict_and_decompose_uncertainty_np(x, models,
   b, _, _, _ = x.shape
 
   # Monte Carlo samples from different deterministic models
-  mc_samples = np.asarray(
-      [model(x, training=training_setting) for model in models]).reshape(-1, b)
+  mc_samples = _stack_samples_to_np(
+      [model(x, training=training_setting) for model in models], b)
 
   return predict_and_decompose_uncertainty_np(mc_samples=mc_samples)
 
@@ -761,7 +778,9 @@ RETINOPATHY_MODEL_TO_TF_DECOMPOSED_UNCERTAINTY_ESTIMATOR = {
 def wrap_retinopathy_estimator(estimator,
                                use_mixed_precision,
                                return_logits=False,
-                               numpy_outputs=True):
+                               numpy_outputs=True,
+                               use_tf_function=False,
+                               jit_compile=False):
   """Models used in the Diabetic Retinopathy baseline output logits by default.
 
   Apply conversion if necessary based on mixed precision setting, and apply
@@ -773,16 +792,29 @@ def wrap_retinopathy_estimator(estimator,
     use_mixed_precision: bool, whether to use mixed precision.
     return_logits: bool, optionally return logits.
     numpy_outputs: bool, convert outputs to numpy.
+    use_tf_function: bool, trace the forward pass (model call, cast and
+      sigmoid) into a single `tf.function` graph instead of running it eagerly
+      op-by-op for every batch.
+    jit_compile: bool, additionally compile the traced forward pass with XLA.
+      Only used if `use_tf_function` is True.
 
   Returns:
      wrapped estimator, outputting sigmoid probabilities.
   """
 
-  def estimator_wrapper(inputs, training, estimator):
+  def forward(inputs, training):
     logits = estimator(inputs, training=training)
     if use_mixed_precision:
       logits = tf.cast(logits, tf.float32)
     probs = tf.squeeze(tf.nn.sigmoid(logits))
+    return probs, logits
+
+  if use_tf_function:
+    # `training` is a Python bool, so each setting is traced once and reused.
+    forward = tf.function(forward, jit_compile=jit_compile)
+
+  def estimator_wrapper(inputs, training):
+    probs, logits = forward(inputs, training=training)
 
     if numpy_outputs and return_logits:
       return probs.numpy(), logits.numpy()
@@ -793,7 +825,7 @@ def wrap_retinopathy_estimator(estimator,
     else:
       return probs
 
-  return functools.partial(estimator_wrapper, estimator=estimator)
+  return estimator_wrapper
 
 
 def negative_log_likelihood_metric(labels, probs):
@@ -15,6 +15,7 @@
 
 """Input pipeline utilities for the ViT experiments."""
 
+import itertools
 import math
 from typing import Callable, Dict, Optional, Union
 
@@ -330,6 +331,30 @@ def get_data(
   return ds.prefetch(prefetch_size)
 
 
+def stack_batches(it, num_batches):
+  """Stacks groups of consecutive batches along a new axis after the devices.
+
+  Args:
+    it: iterator over batches of numpy arrays of shape
+      [num_devices, batch_size_per_device, ...], e.g. as returned by
+      `start_input_pipeline` without prefetching.
+    num_batches: number of consecutive batches to stack together.
+
+  Yields:
+    Batches of shape [num_devices, num_batches, batch_size_per_device, ...]. An
+    incomplete last group is padded with zero-valued batches which, like the
+    padding examples of `get_data`, have a zero-valued `mask`.
+  """
+  it = iter(it)
+  while True:
+    batches = list(itertools.islice(it, num_batches))
+    if not batches:
+      return
+    padding = jax.tree_map(np.zeros_like, batches[0])
+    batches += [padding] * (num_batches - len(batches))
+    yield jax.tree_map(lambda *xs: np.stack(xs, axis=1), *batches)
+
+
 def start_input_pipeline(dataset, n_prefetch, devices=None):
   """Creates a data iterator with optional prefetching and padding."""
   it = iter(dataset)
@@ -21,6 +21,7 @@ import pathlib
 from absl import logging
 from absl.testing import parameterized
 import jax
+import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import uncertainty_baselines as ub
@@ -204,6 +205,24 @@ class InputUtilsTest(parameterized.TestCase, tf.test.TestCase):
     self.assertAllClose(val_image_sum, correct_val_image_sum)
     self.assertAllClose(val_labels_sum, correct_val_labels_sum)
 
+  def test_stack_batches(self):
+    num_devices, batch_size = 2, 3
+    batches = [{
+        "image": np.full((num_devices, batch_size, 4), i, np.float32),
+        "mask": np.ones((num_devices, batch_size), np.float32),
+    } for i in range(5)]
+    stacked = list(input_utils.stack_batches(iter(batches), num_batches=2))
+
+    self.assertLen(stacked, 3)
+    for chunk in stacked:
+      self.assertEqual(chunk["image"].shape, (num_devices, 2, batch_size, 4))
+      self.assertEqual(chunk["mask"].shape, (num_devices, 2, batch_size))
+    self.assertAllEqual(stacked[1]["image"][:, 1], batches[3]["image"])
+    # The incomplete last chunk is padded with masked out batches.
+    self.assertAllEqual(stacked[2]["image"][:, 0], batches[4]["image"])
+    self.assertAllEqual(stacked[2]["mask"][:, 1],
+                        np.zeros((num_devices, batch_size)))
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -15,8 +15,8 @@
 
 """ViT-SNGP on JFT-300M."""
 
+import concurrent.futures
 from functools import partial  # pylint: disable=g-importing-member so standard
-import multiprocessing
 import os
 
 from absl import app
@@ -95,8 +95,8 @@ def main(config, output_dir):
   writer = metric_writers.create_default_writer(
       output_dir, just_logging=jax.process_index() > 0)
 
-  # The pool is used to perform misc operations such as logging in async way.
-  pool = multiprocessing.pool.ThreadPool()
+  # The executor writes checkpoints in the background, one at a time.
+  checkpoint_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
   def write_note(note):
     if jax.process_index() == 0:
@@ -257,6 +257,12 @@ def main(config, output_dir):
 
   # Process ViT backbone model configs.
   vit_kwargs = config.get('model')
+  if config.get('use_bfloat16', False):
+    # Computes the transformer blocks in bfloat16. The parameters, the patch
+    # embedding and the GP head (including its precision matrix) stay float32.
+    vit_kwargs = vit_kwargs.to_dict()
+    vit_kwargs['transformer'] = dict(
+        vit_kwargs['transformer'], dtype=jnp.bfloat16)
 
   model = ub.models.vision_transformer_gp(
       num_classes=config.num_classes,
@@ -271,7 +277,9 @@ def main(config, output_dir):
   def init(rng):
     image_size = tuple(train_ds.element_spec['image'].shape[2:])
     logging.info('image_size = %s', image_size)
-    dummy_input = jnp.zeros((local_batch_size,) + image_size, jnp.float32)
+    # The parameter and state shapes do not depend on the batch size, so a
+    # single example is enough and keeps the CPU forward pass cheap.
+    dummy_input = jnp.zeros((1,) + image_size, jnp.float32)
     variables = model.init(rng, dummy_input, train=False)
     # Split model parameters into trainable and untrainable collections.
     states, params = variables.pop('params')
@@ -288,7 +296,9 @@ def main(config, output_dir):
       params['head']['bias'] = jnp.full_like(
           params['head']['bias'], config.get('init_head_bias', 0))
 
-    return params, states
+    # Parameters are kept frozen from here on, so that the jitted functions
+    # below can use them in `model.apply` as they are.
+    return flax.core.freeze(params), states
 
   rng, rng_init = jax.random.split(rng)
   params_cpu, states_cpu = init(rng_init)
@@ -298,11 +308,18 @@ def main(config, output_dir):
     parameter_overview.log_parameter_overview(params_cpu)
     writer.write_scalars(step=0, scalars={'num_params': num_params})
 
-  @partial(jax.pmap, axis_name='batch')
-  def evaluation_fn(params, states, images, labels, mask):
+  # Resolve the configured losses once, outside of the functions traced below.
+  # Note that the CIFAR-10H evaluation defaults to the softmax loss.
+  loss_name = config.get('loss', 'sigmoid_xent')
+  train_loss_fn = getattr(train_utils, loss_name)
+  per_example_loss_fn = partial(train_loss_fn, reduction=False)
+  cifar_10h_per_example_loss_fn = partial(
+      getattr(train_utils, config.get('loss', 'softmax_xent')), reduction=False)
+
+  def evaluate_batch(params, states, images, labels, mask):
     # Ignore the entries with all zero labels for evaluation.
     mask *= labels.max(axis=1)
-    variable_dict = {'params': flax.core.freeze(params), **states}
+    variable_dict = {'params': params, **states}
     logits, out = model.apply(
         variable_dict,
         images,
@@ -314,41 +331,56 @@ def main(config, output_dir):
     # adjust labels to labels[:, :config.num_classes] to match the shape of
     # logits. That is just to avoid shape mismatch. The output losses does not
     # have any meaning for OOD data, because OOD not belong to any IND class.
-    losses = getattr(train_utils, config.get('loss', 'sigmoid_xent'))(
-        logits=logits, labels=labels[:, :config.num_classes], reduction=False)
-    loss = jax.lax.psum(losses * mask, axis_name='batch')
+    losses = per_example_loss_fn(
+        logits=logits, labels=labels[:, :config.num_classes])
+    # The counts are summed on each device before the `psum`, so that only
+    # scalars are returned to the host.
+    loss = jax.lax.psum(jnp.sum(losses * mask), axis_name='batch')
 
     top1_idx = jnp.argmax(logits, axis=1)
     # Extracts the label at the highest logit index for each image.
     top1_correct = jnp.take_along_axis(labels, top1_idx[:, None], axis=1)[:, 0]
-    ncorrect = jax.lax.psum(top1_correct * mask, axis_name='batch')
-    n = jax.lax.psum(mask, axis_name='batch')
+    ncorrect = jax.lax.psum(jnp.sum(top1_correct * mask), axis_name='batch')
+    n = jax.lax.psum(jnp.sum(mask), axis_name='batch')
 
     metric_args = jax.lax.all_gather([logits, labels, out['pre_logits'], mask],
                                      axis_name='batch')
     return ncorrect, loss, n, metric_args
 
+  evaluation_fn = jax.pmap(evaluate_batch, axis_name='batch')
+
+  @partial(jax.pmap, axis_name='batch')
+  def evaluation_k_fn(params, states, images, labels, mask):
+    """Sums the `evaluate_batch` counts over a leading axis of batches."""
+
+    def scan_batch(totals, batch):
+      ncorrect, loss, n, _ = evaluate_batch(params, states, *batch)
+      totals = jax.tree_util.tree_map(lambda t, x: t + x, totals,
+                                      (ncorrect, loss, n))
+      return totals, None
+
+    totals = (jnp.zeros((), jnp.float32),) * 3
+    totals, _ = jax.lax.scan(scan_batch, totals, (images, labels, mask))
+    return totals
+
   @partial(jax.pmap, axis_name='batch')
   def cifar_10h_evaluation_fn(params, states, images, labels, mask):
-    variable_dict = {'params': flax.core.freeze(params), **states}
+    variable_dict = {'params': params, **states}
     logits, out = model.apply(
         variable_dict,
         images,
         train=False,
         mean_field_factor=gp_config.get('mean_field_factor', -1.))
 
-    losses = getattr(train_utils, config.get('loss', 'softmax_xent'))(
-        logits=logits, labels=labels, reduction=False)
-    loss = jax.lax.psum(losses, axis_name='batch')
+    losses = cifar_10h_per_example_loss_fn(logits=logits, labels=labels)
+    loss = jax.lax.psum(jnp.sum(losses), axis_name='batch')
 
-    top1_idx = jnp.argmax(logits, axis=1)
-    # Extracts the label at the highest logit index for each image.
-    one_hot_labels = jnp.eye(10)[jnp.argmax(labels, axis=1)]
-
-    top1_correct = jnp.take_along_axis(
-        one_hot_labels, top1_idx[:, None], axis=1)[:, 0]
-    ncorrect = jax.lax.psum(top1_correct, axis_name='batch')
-    n = jax.lax.psum(one_hot_labels, axis_name='batch')
+    # A prediction is correct if its top logit is at the most likely label,
+    # which compares the two argmaxes without building one-hot labels.
+    top1_correct = jnp.argmax(logits, axis=1) == jnp.argmax(labels, axis=1)
+    ncorrect = jax.lax.psum(
+        jnp.sum(top1_correct, dtype=jnp.float32), axis_name='batch')
+    n = jax.lax.psum(jnp.sum(jnp.ones_like(losses)), axis_name='batch')
 
     metric_args = jax.lax.all_gather([logits, labels, out['pre_logits'], mask],
                                      axis_name='batch')
@@ -357,7 +389,7 @@ def main(config, output_dir):
   # Setup function for computing representation.
   @partial(jax.pmap, axis_name='batch')
   def representation_fn(params, images, labels, mask, states):
-    variable_dict = {'params': flax.core.freeze(params), **states}
+    variable_dict = {'params': params, **states}
     _, outputs = model.apply(
         variable_dict,
         images,
@@ -381,12 +413,23 @@ def main(config, output_dir):
   weight_decay_rules = config.get('weight_decay', []) or []
   rescale_value = 1.
   weight_decay_fn = train_utils.get_weight_decay_fn(
-      weight_decay_rules=weight_decay_rules, rescale_value=rescale_value)
+      weight_decay_rules=weight_decay_rules,
+      rescale_value=rescale_value,
+      params=params_cpu)
+
+  # The learning rate and the precision matrix resetting schedules are pure
+  # functions of the step, computed on device inside the update step.
+  lr_fn = train_utils.create_learning_rate_schedule(total_steps,
+                                                    **config.get('lr', {}))
+  reset_steps = steps_per_epoch * 1
+  reset_covmat_fn = lambda step: jnp.asarray(step % reset_steps == 0,
+                                             jnp.float32)
 
-  @partial(jax.pmap, axis_name='batch', donate_argnums=(0,))
-  def update_fn(opt, states, lr, reset_covmat, images, labels, rng):
+  def update_step(opt, states, step, images, labels, rng):
     """Update step."""
     measurements = {}
+    lr = lr_fn(step)
+    reset_covmat = reset_covmat_fn(step)
 
     # Get device-specific loss rng.
     rng, rng_model = jax.random.split(rng, 2)
@@ -394,7 +437,7 @@ def main(config, output_dir):
 
     def loss_fn(params, states, images, labels):
       # Specify mutable collection to update untrainable GP parameters.
-      variable_dict = {'params': flax.core.freeze(params), **states}
+      variable_dict = {'params': params, **states}
       model_results, updated_states = model.apply(
           variable_dict,
           images,
@@ -404,8 +447,7 @@ def main(config, output_dir):
           mean_field_factor=gp_config.get('mean_field_factor', -1.))
 
       logits, _ = model_results
-      loss = getattr(train_utils, config.get('loss', 'sigmoid_xent'))(
-          logits=logits, labels=labels)
+      loss = train_loss_fn(logits=logits, labels=labels)
       return loss, updated_states
 
     # Performs exact covariance update (i.e., reset precision matrix resetting
@@ -429,15 +471,15 @@ def main(config, output_dir):
     # https://docs.google.com/document/d/1g3kMEvqu1DOawaflKNyUsIoQ4yIVEoyE5ZlIPkIl4Lc/edit?hl=en#
     (l, s), g = train_utils.accumulate_gradient_with_states(
         jax.value_and_grad(loss_fn, has_aux=True), opt.target, states, images,
-        labels, config.get('grad_accum_steps'))
+        labels, config.get('grad_accum_steps'),
+        unroll=config.get('grad_accum_unroll', 1))
     l, g = jax.lax.pmean((l, g), axis_name='batch')
 
     # Log the gradient norm only if we need to compute it anyways (clipping)
     # or if we don't use grad_accum_steps, as they interact badly.
     do_grad_clip = config.get('grad_clip_norm', -1.) > 0.
     if config.get('grad_accum_steps', 1) == 1 or do_grad_clip:
-      grads, _ = jax.tree_flatten(g)
-      l2_g = jnp.sqrt(sum([jnp.vdot(p, p) for p in grads]))
+      l2_g = train_utils.global_norm(g)
       measurements['l2_grads'] = l2_g
 
     # Optionally resize the global gradient to a maximum norm. We found this
@@ -448,12 +490,34 @@ def main(config, output_dir):
     opt = opt.apply_gradient(g, learning_rate=lr)
     opt = opt.replace(target=weight_decay_fn(opt.target, lr))
 
-    params, _ = jax.tree_flatten(opt.target)
-    measurements['l2_params'] = jnp.sqrt(sum([jnp.vdot(p, p) for p in params]))
+    measurements['l2_params'] = train_utils.global_norm(opt.target)
+    measurements['learning_rate'] = lr
     measurements['reset_covmat'] = reset_covmat
 
     return opt, s, l, rng, measurements
 
+  # The optimizer, the states and the rng are all replaced by the outputs,
+  # including the large precision matrix, so donate their buffers to be updated
+  # in place.
+  update_fn = jax.pmap(
+      update_step, axis_name='batch', donate_argnums=(0, 1, 5))
+
+  @partial(jax.pmap, axis_name='batch', donate_argnums=(0, 1, 5))
+  def update_k_steps_fn(opt, states, steps, images, labels, rng):
+    """Runs `update_step` over a leading axis of steps with `jax.lax.scan`."""
+
+    def scan_step(carry, step_inputs):
+      opt, states, rng = carry
+      opt, states, loss, rng, measurements = update_step(
+          opt, states, *step_inputs, rng)
+      return (opt, states, rng), (loss, measurements)
+
+    (opt, states, rng), (losses, measurements) = jax.lax.scan(
+        scan_step, (opt, states, rng), (steps, images, labels))
+    # Only the last step is reported (see `get_update_chunk_sizes`).
+    measurements = jax.tree_map(lambda x: x[-1], measurements)
+    return opt, states, losses[-1], rng, measurements
+
   default_reinit_params = ('head/output_layer/kernel', 'head/output_layer/bias',
                            'head/kernel', 'head/bias')
   rng, train_loop_rngs = jax.random.split(rng)
@@ -466,7 +530,9 @@ def main(config, output_dir):
       default_reinit_params=default_reinit_params,
       config=config)
   train_loop_rngs = checkpoint_data.train_loop_rngs
+  # Parameters restored from a pretrained model may be a plain dict.
   opt_cpu = checkpoint_data.optimizer
+  opt_cpu = opt_cpu.replace(target=flax.core.freeze(opt_cpu.target))
   states_cpu = checkpoint_data.fixed_model_states
   accumulated_train_time = checkpoint_data.accumulated_train_time
 
@@ -505,12 +571,61 @@ def main(config, output_dir):
   # when eval takes place.
   log_eval_steps = max(steps_per_epoch, 2)
 
-  lr_fn = train_utils.create_learning_rate_schedule(total_steps,
-                                                    **config.get('lr', {}))
-
-  # Prepare the precision matrix resetting schedule.
-  reset_steps = steps_per_epoch * 1
-  reset_covmat_fn = lambda step: float(step % reset_steps == 0)
+  # Several training steps can be fused into one `update_k_steps_fn` call to
+  # cut per-step dispatch overhead. Fused chunks never contain a step after
+  # which the host needs the training state, which instead runs on its own.
+  steps_per_call = config.get('train_steps_per_call', 1)
+
+  def is_host_sync_step(step):
+    # Note: no `process` filter, all hosts must compute the same chunks.
+    return (train_utils.itstime(step, config.get('checkpoint_steps'),
+                                total_steps) or
+            train_utils.itstime(step, config.log_training_steps, total_steps) or
+            train_utils.itstime(step, log_eval_steps, total_steps) or
+            ('fewshot' in config and train_utils.itstime(
+                step, config.fewshot.log_steps, total_steps)) or
+            step == config.get('testing_failure_step'))
+
+  def get_update_chunk_sizes():
+    step = first_step + 1
+    while step <= total_steps:
+      last_step = step + steps_per_call - 1
+      num_steps = 1
+      if last_step <= total_steps and not any(
+          is_host_sync_step(s) for s in range(step, last_step)):
+        num_steps = steps_per_call
+      yield num_steps
+      step += num_steps
+
+  def get_train_chunks(train_iter):
+    n_loc_dev = jax.local_device_count()
+    # The schedules of a step are evaluated at the previous step.
+    schedule_step = first_step
+    for num_steps in get_update_chunk_sizes():
+      chunk = None
+      for i in range(num_steps):
+        train_batch = next(train_iter)
+        step_inputs = {
+            'image': train_batch['image'],
+            'labels': train_batch['labels'],
+            'step': np.full(n_loc_dev, schedule_step, np.int32),
+        }
+        schedule_step += 1
+        if num_steps == 1:
+          chunk = step_inputs
+          break
+        if chunk is None:
+          # The steps are stacked after the device axis: [devices, steps, ...].
+          # Each chunk gets new buffers, as the previous chunk may still be
+          # in flight to the devices.
+          chunk = {
+              k: np.empty((x.shape[0], num_steps) + x.shape[1:], x.dtype)
+              for k, x in step_inputs.items()
+          }
+        # Copy each batch into its slot as it arrives.
+        for k, x in step_inputs.items():
+          chunk[k][:, i] = x
+      yield chunk
 
   # Prefetch all iterators, starting at the current first step.
   if first_step > 0:
@@ -520,14 +635,10 @@ def main(config, output_dir):
 
   # TODO(dusenberrymw): According to flax docs, prefetching shouldn't be
   # necessary for TPUs.
-  train_iter = input_utils.start_input_pipeline(
-      train_ds, config.get('prefetch_to_device', 1))
-  lr_iter = train_utils.prefetch_scalar(
-      map(lr_fn, range(first_step, total_steps)),
-      config.get('prefetch_to_device', 1))
-  reset_covmat_iter = train_utils.prefetch_scalar(
-      map(reset_covmat_fn, range(first_step, total_steps)),
-      nprefetch=config.get('prefetch_to_device', 1))
+  train_iter = get_train_chunks(input_utils.start_input_pipeline(train_ds, 0))
+  if config.get('prefetch_to_device', 1):
+    train_iter = flax_utils.prefetch_to_device(
+        train_iter, config.get('prefetch_to_device', 1))
 
   # Note: we return the train loss, val loss, and fewshot best l2s for use in
   # reproducibility unit tests.
@@ -535,22 +646,74 @@ def main(config, output_dir):
   val_loss = {val_name: -jnp.inf for val_name, _ in val_ds_splits.items()}
   fewshot_results = {'dummy': {(0, 1): -jnp.inf}}
 
+  if config.get('log_compiles', False):
+    # Logs every compilation, which makes accidental recompilations visible.
+    jax.config.update('jax_log_compiles', True)
+
+  # Ahead-of-time compiled update functions, keyed by the number of steps per
+  # call. Calling the compiled executables pins the input shapes and dtypes:
+  # inputs that would silently trigger a recompilation raise an error instead.
+  compiled_update_fns = {}
+
+  # Without uncertainty metrics only the counts are needed, so several
+  # batches can be evaluated per call and summed on device.
+  val_steps_per_call = config.get('val_steps_per_call', 1)
+
+  def use_val_chunks(val_name):
+    return (val_steps_per_call > 1 and val_name != 'cifar_10h' and
+            loss_name == 'sigmoid_xent')
+
+  # Ahead-of-time compiled evaluation functions, keyed by the function name and
+  # the batch shapes. The params and states shapes are fixed during training.
+  compiled_eval_fns = {}
+
+  def get_compiled_eval_fn(eval_fn, params, states, images, labels, mask):
+    key = (eval_fn.__name__, images.shape, labels.shape)
+    if key not in compiled_eval_fns:
+      compiled_eval_fns[key] = eval_fn.lower(params, states, images, labels,
+                                             mask).compile()
+    return compiled_eval_fns[key]
+
+  # Compiles the evaluation functions before training starts, from zero batches
+  # shaped like the validation splits, rather than during the first val pass.
+  write_note(f'Compiling the evaluation functions...\n{chrono.note}')
+  for val_name, val_ds in val_ds_splits.items():
+    val_batch = {
+        k: np.zeros(val_ds.element_spec[k].shape,
+                    val_ds.element_spec[k].dtype.as_numpy_dtype)
+        for k in ('image', 'labels', 'mask')
+    }
+    if use_val_chunks(val_name):
+      eval_fn = evaluation_k_fn
+      val_batch = {
+          k: np.zeros((x.shape[0], val_steps_per_call) + x.shape[1:], x.dtype)
+          for k, x in val_batch.items()
+      }
+    elif val_name == 'cifar_10h':
+      eval_fn = cifar_10h_evaluation_fn
+    else:
+      eval_fn = evaluation_fn
+    get_compiled_eval_fn(eval_fn, opt_repl.target, states_repl,
+                         val_batch['image'], val_batch['labels'],
+                         val_batch['mask'])
+
   write_note(f'First step compilations...\n{chrono.note}')
-  for step in range(first_step + 1, total_steps + 1):
+  step = first_step
+  for num_steps in get_update_chunk_sizes():
+    step += num_steps
     with jax.profiler.StepTraceAnnotation('train_step', step_num=step):
-      train_batch = next(train_iter)
-      lr_repl = next(lr_iter)
-      reset_covmat_repl = next(reset_covmat_iter)
+      train_chunk = next(train_iter)
       # TODO(jereliu): Expand to allow precision matrix resetting.
+      update_args = (opt_repl, states_repl, train_chunk['step'],
+                     train_chunk['image'], train_chunk['labels'],
+                     train_loop_rngs)
+      if num_steps not in compiled_update_fns:
+        write_note(f'Compiling the update for {num_steps} step(s)...')
+        chunk_update_fn = update_fn if num_steps == 1 else update_k_steps_fn
+        compiled_update_fns[num_steps] = chunk_update_fn.lower(
+            *update_args).compile()
       (opt_repl, states_repl, loss_value, train_loop_rngs,
-       extra_measurements) = update_fn(
-           opt_repl,
-           states_repl,
-           lr_repl,
-           reset_covmat_repl,
-           train_batch['image'],
-           train_batch['labels'],
-           rng=train_loop_rngs)
+       extra_measurements) = compiled_update_fns[num_steps](*update_args)
 
     if jax.process_index() == 0:
       profiler(step)
@@ -570,8 +733,12 @@ def main(config, output_dir):
       # (`states`). This is ok since `random features` are frozen throughout
       # pre-training, and `precision matrix` is a finetuning-specific parameters
       # that will be re-learned in the finetuning task.
-      opt_cpu = jax.tree_map(lambda x: np.array(x[0]), opt_repl)
-      states_cpu = jax.tree_map(lambda x: np.array(x[0]), states_repl)
+      # `jax.device_get` starts the copies of all leaves before waiting on any
+      # of them. It stays synchronous since `opt_repl`, `states_repl` and
+      # `train_loop_rngs` are donated next step.
+      (opt_cpu, states_cpu), train_loop_rngs_cpu = jax.device_get(
+          (jax.tree_util.tree_map(lambda x: x[0], (opt_repl, states_repl)),
+           train_loop_rngs))
 
       # Check whether we want to keep a copy of the current checkpoint.
       copy_step = None
@@ -585,11 +752,11 @@ def main(config, output_dir):
       checkpoint_data = checkpoint_utils.CheckpointData(
           optimizer=opt_cpu,
           fixed_model_states=states_cpu,
-          train_loop_rngs=train_loop_rngs,
+          train_loop_rngs=train_loop_rngs_cpu,
           accumulated_train_time=accumulated_train_time)
-      checkpoint_writer = pool.apply_async(
-          checkpoint_utils.checkpoint_trained_model,
-          (checkpoint_data, save_checkpoint_path, copy_step))
+      checkpoint_writer = checkpoint_executor.submit(
+          checkpoint_utils.checkpoint_trained_model, checkpoint_data,
+          save_checkpoint_path, copy_step)
       chrono.resume()
 
     # Report training progress
@@ -601,7 +768,6 @@ def main(config, output_dir):
       write_note(note)
       train_measurements = {}
       train_measurements.update({
-          'learning_rate': lr_repl[0],
           'training_loss': train_loss,
       })
       train_measurements.update(flax.jax_utils.unreplicate(extra_measurements))
@@ -632,59 +798,73 @@ def main(config, output_dir):
         ged = tf.keras.metrics.Mean()
 
         # Runs evaluation loop.
-        val_iter = input_utils.start_input_pipeline(
-            val_ds, config.get('prefetch_to_device', 1))
         ncorrect, loss, nseen = 0, 0, 0
-        for batch in val_iter:
-          if val_name == 'cifar_10h':
-            batch_ncorrect, batch_losses, batch_n, batch_metric_args = (
-                cifar_10h_evaluation_fn(
-                    opt_repl.target, states_repl, batch['image'],
-                    batch['labels'], batch['mask']))
-          else:
+        if use_val_chunks(val_name):
+          val_iter = input_utils.stack_batches(
+              input_utils.start_input_pipeline(val_ds, 0), val_steps_per_call)
+          if config.get('prefetch_to_device', 1):
+            val_iter = flax_utils.prefetch_to_device(
+                val_iter, config.get('prefetch_to_device', 1))
+          for batch in val_iter:
+            eval_args = (opt_repl.target, states_repl, batch['image'],
+                         batch['labels'], batch['mask'])
+            batch_ncorrect, batch_loss, batch_n = get_compiled_eval_fn(
+                evaluation_k_fn, *eval_args)(*eval_args)
+            ncorrect += batch_ncorrect[0]
+            loss += batch_loss[0]
+            nseen += batch_n[0]
+        else:
+          val_iter = input_utils.start_input_pipeline(
+              val_ds, config.get('prefetch_to_device', 1))
+          eval_fn = (cifar_10h_evaluation_fn if val_name == 'cifar_10h'
+                     else evaluation_fn)
+          for batch in val_iter:
+            eval_args = (opt_repl.target, states_repl, batch['image'],
+                         batch['labels'], batch['mask'])
             batch_ncorrect, batch_losses, batch_n, batch_metric_args = (
-                evaluation_fn(opt_repl.target, states_repl, batch['image'],
-                              batch['labels'], batch['mask']))
-          # All results are a replicated array shaped as follows:
-          # (local_devices, per_device_batch_size, elem_shape...)
-          # with each local device's entry being identical as they got psum'd.
-          # So let's just take the first one to the host as numpy.
-          ncorrect += np.sum(np.array(batch_ncorrect[0]))
-          loss += np.sum(np.array(batch_losses[0]))
-          nseen += np.sum(np.array(batch_n[0]))
-          if config.get('loss', 'sigmoid_xent') != 'sigmoid_xent':
-            # Here we parse batch_metric_args to compute uncertainty metrics.
-            # (e.g., ECE or Calibration AUC).
-            logits, labels, _, masks = batch_metric_args
-            masks = np.array(masks[0], dtype=np.bool)
-            logits = np.array(logits[0])
-            probs = jax.nn.softmax(logits)
-            # From one-hot to integer labels, as required by ECE.
-            int_labels = np.argmax(np.array(labels[0]), axis=-1)
-            int_preds = np.argmax(logits, axis=-1)
-            confidence = np.max(probs, axis=-1)
-            for p, c, l, d, m, label in zip(probs, confidence, int_labels,
-                                            int_preds, masks, labels[0]):
-              ece.add_batch(p[m, :], label=l[m])
-              calib_auc.add_batch(d[m], label=l[m], confidence=c[m])
-              oc_auc_0_5.add_batch(d[m], label=l[m], custom_binning_score=c[m])
-              oc_auc_1.add_batch(d[m], label=l[m], custom_binning_score=c[m])
-              oc_auc_2.add_batch(d[m], label=l[m], custom_binning_score=c[m])
-              oc_auc_5.add_batch(d[m], label=l[m], custom_binning_score=c[m])
-
-              if val_name == 'cifar_10h' or val_name == 'imagenet_real':
-                batch_label_diversity, batch_sample_diversity, batch_ged = data_uncertainty_utils.generalized_energy_distance(
-                    label[m], p[m, :], config.num_classes)
-                label_diversity.update_state(batch_label_diversity)
-                sample_diversity.update_state(batch_sample_diversity)
-                ged.update_state(batch_ged)
-
+                get_compiled_eval_fn(eval_fn, *eval_args)(*eval_args))
+            # The counts are replicated scalars, with each local device's entry
+            # being identical as they got psum'd. So let's just take the first
+            # one, and keep the running totals on device.
+            ncorrect += batch_ncorrect[0]
+            loss += batch_losses[0]
+            nseen += batch_n[0]
+            if loss_name != 'sigmoid_xent':
+              # Here we parse batch_metric_args to compute uncertainty metrics.
+              # (e.g., ECE or Calibration AUC).
+              logits, labels, _, masks = batch_metric_args
+              masks = np.array(masks[0], dtype=np.bool)
+              logits = np.array(logits[0])
+              probs = jax.nn.softmax(logits)
+              # From one-hot to integer labels, as required by ECE.
+              int_labels = np.argmax(np.array(labels[0]), axis=-1)
+              int_preds = np.argmax(logits, axis=-1)
+              confidence = np.max(probs, axis=-1)
+              for p, c, l, d, m, label in zip(probs, confidence, int_labels,
+                                              int_preds, masks, labels[0]):
+                ece.add_batch(p[m, :], label=l[m])
+                calib_auc.add_batch(d[m], label=l[m], confidence=c[m])
+                oc_auc_0_5.add_batch(
+                    d[m], label=l[m], custom_binning_score=c[m])
+                oc_auc_1.add_batch(d[m], label=l[m], custom_binning_score=c[m])
+                oc_auc_2.add_batch(d[m], label=l[m], custom_binning_score=c[m])
+                oc_auc_5.add_batch(d[m], label=l[m], custom_binning_score=c[m])
+
+                if val_name == 'cifar_10h' or val_name == 'imagenet_real':
+                  batch_label_diversity, batch_sample_diversity, batch_ged = data_uncertainty_utils.generalized_energy_distance(
+                      label[m], p[m, :], config.num_classes)
+                  label_diversity.update_state(batch_label_diversity)
+                  sample_diversity.update_state(batch_sample_diversity)
+                  ged.update_state(batch_ged)
+
+        # Only the final totals are transferred to the host.
+        ncorrect, loss, nseen = jax.device_get((ncorrect, loss, nseen))
         val_loss[val_name] = loss / nseen  # Keep for reproducibility tests.
         val_measurements = {
             f'{val_name}_prec@1': ncorrect / nseen,
             f'{val_name}_loss': val_loss[val_name]
         }
-        if config.get('loss', 'sigmoid_xent') != 'sigmoid_xent':
+        if loss_name != 'sigmoid_xent':
           val_measurements[f'{val_name}_ece'] = ece.result()['ece']
           val_measurements[f'{val_name}_calib_auc'] = calib_auc.result()[
               'calibration_auc']
@@ -766,8 +946,7 @@ def main(config, output_dir):
         break
 
   write_note(f'Done!\n{chrono.note}')
-  pool.close()
-  pool.join()
+  checkpoint_executor.shutdown(wait=True)
   writer.close()
 
   # Return final training loss, validation loss, and fewshot results for
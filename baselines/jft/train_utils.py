@@ -19,12 +19,14 @@ Several functions in this file were ported from
 https://github.com/google-research/vision_transformer.
 """
 
+import concurrent.futures
 import multiprocessing
 import numbers
+import operator
 import re
 import time
 
-from typing import Callable, List, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
 
 from absl import logging
 import flax
@@ -70,7 +72,7 @@ def accumulate_gradient(loss_and_grad_fn, params, images, labels, accum_steps):
                                    (step_size, labels.shape[1]))
       li, gi = loss_and_grad_fn(params, imgs, lbls)
       l, g = l_and_g
-      return (l + li, jax.tree_multimap(lambda x, y: x + y, g, gi))
+      return (l + li, jax.tree_util.tree_map(operator.add, g, gi))
 
     l, g = jax.lax.fori_loop(1, accum_steps, acc_grad_and_loss, (l, g))
     return jax.tree_util.tree_map(lambda x: x / accum_steps, (l, g))
@@ -84,38 +86,65 @@ def accumulate_gradient_with_states(
     states,  # Allows for states.
     images,
     labels,
-    accum_steps):
-  """Improved version of `train_utils.accumulate_gradient()` that allows for states."""
+    accum_steps,
+    unroll=1):
+  """Improved version of `train_utils.accumulate_gradient()` that allows for states.
+
+  The batch is reshaped into `accum_steps` microbatches along a new leading
+  axis, which are consumed by a `jax.lax.scan` rather than carved out with
+  `dynamic_slice` inside a `fori_loop`.
+
+  Args:
+    loss_and_grad_fn: function taking `(params, states, images, labels)` and
+      returning `((loss, states), grads)`.
+    params: the model parameters.
+    states: the model states, threaded through the microbatches.
+    images: the batch of images.
+    labels: the batch of labels.
+    accum_steps: the number of microbatches to split the batch into.
+    unroll: how many microbatch iterations of the scan to unroll, which trades
+      compilation time for runtime.
+
+  Returns:
+    `((loss, states), grads)`, where the loss and gradients are averaged over
+    the microbatches.
+  """
   # This function handles the `loss_and_grad_fn` function which takes a state
   # argument and returns ((losses, states), grads).
   if accum_steps and accum_steps > 1:
     assert images.shape[0] % accum_steps == 0, (
         f"Bad accum_steps {accum_steps} for batch size {images.shape[0]}")
     step_size = images.shape[0] // accum_steps
+    images = images.reshape((accum_steps, step_size) + images.shape[1:])
+    labels = labels.reshape((accum_steps, step_size) + labels.shape[1:])
 
     # Run the first step.
-    (l, s), g = loss_and_grad_fn(params, states, images[:step_size],
-                                 labels[:step_size])
+    (l, s), g = loss_and_grad_fn(params, states, images[0], labels[0])
 
     # Run the rest of the steps.
-    def acc_grad_and_loss(i, l_s_g):
-      # Extract data for current step.
-      imgs = jax.lax.dynamic_slice(images, (i * step_size, 0, 0, 0),
-                                   (step_size,) + images.shape[1:])
-      lbls = jax.lax.dynamic_slice(labels, (i * step_size, 0),
-                                   (step_size, labels.shape[1]))
+    def acc_grad_and_loss(l_s_g, imgs_and_lbls):
       # Update state and accumulate gradient.
       l, s, g = l_s_g
+      imgs, lbls = imgs_and_lbls
       (li, si), gi = loss_and_grad_fn(params, s, imgs, lbls)
-      return (l + li, si, jax.tree_multimap(lambda x, y: x + y, g, gi))
+      return (l + li, si, jax.tree_util.tree_map(operator.add, g, gi)), None
 
-    l, s, g = jax.lax.fori_loop(1, accum_steps, acc_grad_and_loss, (l, s, g))
-    l, g = jax.tree_map(lambda x: x / accum_steps, (l, g))
+    (l, s, g), _ = jax.lax.scan(
+        acc_grad_and_loss, (l, s, g), (images[1:], labels[1:]), unroll=unroll)
+    l, g = jax.tree_util.tree_map(lambda x: x / accum_steps, (l, g))
     return (l, s), g
   else:
     return loss_and_grad_fn(params, states, images, labels)
 
 
+def global_norm(tree):
+  """Computes the L2 norm of all the leaves of a pytree taken together."""
+  sum_of_squares = jax.tree_util.tree_reduce(
+      lambda acc, x: acc + jnp.vdot(x, x), tree,
+      jnp.zeros((), dtype=jnp.float32))
+  return jnp.sqrt(sum_of_squares)
+
+
 def create_learning_rate_schedule(total_steps,
                                   base=0.,
                                   decay_type="linear",
@@ -160,7 +189,8 @@ def create_learning_rate_schedule(total_steps,
 
 def get_weight_decay_fn(
     weight_decay_rules: Union[float, List[Tuple[str, float]]],
-    rescale_value: float) -> Callable[[Params, float], Params]:
+    rescale_value: float,
+    params: Optional[Params] = None) -> Callable[[Params, float], Params]:
   """Returns a custom weight-decay function for the learning rate.
 
   Args:
@@ -171,6 +201,10 @@ def get_weight_decay_fn(
       BatchEnsemble slow and fast weights at different rates.
     rescale_value: scalar indicating by how much the initial learning rate needs
       to be scaled before applying the weight decay.
+    params: optional pytree with the structure of the parameters that will be
+      decayed. If given, the rules are matched against the parameter names once
+      here, and the returned function applies the resulting per-parameter rates
+      with a single tree_map instead of matching the regexes on every call.
 
   Returns:
     A function mapping a pytree of parameters and a learning rate to an updated
@@ -180,6 +214,18 @@ def get_weight_decay_fn(
     # Append weight decay factor to variable name patterns it applies to.
     weight_decay_rules = [(".*kernel.*", weight_decay_rules)]
 
+  if params is not None:
+    decay_rates = tree_map_with_regex(
+        lambda _, wd: wd, jax.tree_util.tree_map(lambda _: 0., params),
+        weight_decay_rules)
+
+    def precomputed_weight_decay_fn(params, lr):
+      return jax.tree_util.tree_map(
+          lambda p, wd: (1.0 - lr / rescale_value * wd) * p if wd else p,
+          params, decay_rates)
+
+    return precomputed_weight_decay_fn
+
   def weight_decay_fn(params, lr):
     return tree_map_with_regex(
         lambda params, wd: (1.0 - lr / rescale_value * wd) * params,
@@ -215,6 +261,9 @@ def tree_map_with_regex(f, tree, regex_rules):
   flat_tree = flax.traverse_util.flatten_dict(tree)
   updated_flat_tree = {k: _f(k, v) for k, v in flat_tree.items()}
   updated_tree = flax.traverse_util.unflatten_dict(updated_flat_tree)
+  # Keep frozen trees frozen, e.g. parameters that are passed to `model.apply`.
+  if isinstance(tree, flax.core.FrozenDict):
+    updated_tree = flax.core.freeze(updated_tree)
   return updated_tree
 
 
@@ -227,11 +276,15 @@ def prefetch_scalar(it, nprefetch=1, devices=None):
 
 def checkpointing_timeout(writer, timeout):
   """Checks that checkpointing is not a bottleneck."""
-  # Make sure checkpoint writing is not a bottleneck
+  # Make sure checkpoint writing is not a bottleneck. The `writer` is either a
+  # `multiprocessing` AsyncResult or a `concurrent.futures.Future`.
   if writer is not None:
     try:
-      writer.get(timeout=timeout)
-    except multiprocessing.TimeoutError:
+      if isinstance(writer, concurrent.futures.Future):
+        writer.result(timeout=timeout)
+      else:
+        writer.get(timeout=timeout)
+    except (multiprocessing.TimeoutError, concurrent.futures.TimeoutError):
       raise TimeoutError(
           "Checkpoint writing seems to be a bottleneck. Make sure you do "
           "not do something wrong, like writing checkpoints to a distant "
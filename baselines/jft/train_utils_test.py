@@ -18,6 +18,7 @@
 from absl.testing import absltest
 from absl.testing import parameterized
 import jax
+import jax.numpy as jnp
 import numpy as np
 import train_utils  # local file import from baselines.jft
 
@@ -53,6 +54,37 @@ class TrainUtilsTest(parameterized.TestCase):
     # TODO(dusenberrymw): Add a test for this.
     pass
 
+  @parameterized.parameters(1, 2)
+  def test_accumulate_gradient_with_states(self, unroll):
+    key = jax.random.PRNGKey(42)
+    key1, key2, key3 = jax.random.split(key, 3)
+    images = jax.random.normal(key1, shape=(8, 3))
+    labels = jax.random.normal(key2, shape=(8, 1))
+    params = {"kernel": jax.random.normal(key3, shape=(3, 1))}
+    states = {"count": 0.}
+
+    def loss_fn(params, states, images, labels):
+      loss = jnp.mean((images @ params["kernel"] - labels)**2)
+      return loss, {"count": states["count"] + 1.}
+
+    loss_and_grad_fn = jax.value_and_grad(loss_fn, has_aux=True)
+    (expected_loss, _), expected_grads = loss_and_grad_fn(
+        params, states, images, labels)
+    (actual_loss, actual_states), actual_grads = (
+        train_utils.accumulate_gradient_with_states(
+            loss_and_grad_fn, params, states, images, labels, accum_steps=4,
+            unroll=unroll))
+    np.testing.assert_allclose(actual_loss, expected_loss,
+                               rtol=1e-06, atol=1e-06)
+    np.testing.assert_allclose(actual_grads["kernel"], expected_grads["kernel"],
+                               rtol=1e-06, atol=1e-06)
+    self.assertEqual(actual_states["count"], 4.)
+
+  def test_global_norm(self):
+    tree = {"bias": jnp.array([3., 4.]), "kernel": {"w": jnp.full((2, 2), 1.)}}
+    np.testing.assert_allclose(train_utils.global_norm(tree), np.sqrt(29.),
+                               rtol=1e-06, atol=1e-06)
+
   def test_create_learning_rate_schedule(self):
     total_steps = 10
     base = 0.1
@@ -103,13 +135,14 @@ class TrainUtilsTest(parameterized.TestCase):
   def test_get_weight_decay_fn(
       self, weight_decay_rules, rescale_value, learning_rate,
       input_params, expected_decayed_params):
-    weight_decay_fn = train_utils.get_weight_decay_fn(
-        weight_decay_rules, rescale_value)
-    actual_decayed_params = weight_decay_fn(input_params, learning_rate)
-    actual_leaves = jax.tree_util.tree_leaves(actual_decayed_params)
-    expected_leaves = jax.tree_util.tree_leaves(expected_decayed_params)
-    for actual_arr, expected_arr in zip(actual_leaves, expected_leaves):
-      np.testing.assert_allclose(actual_arr, expected_arr)
+    for params in (None, input_params):
+      weight_decay_fn = train_utils.get_weight_decay_fn(
+          weight_decay_rules, rescale_value, params=params)
+      actual_decayed_params = weight_decay_fn(input_params, learning_rate)
+      actual_leaves = jax.tree_util.tree_leaves(actual_decayed_params)
+      expected_leaves = jax.tree_util.tree_leaves(expected_decayed_params)
+      for actual_arr, expected_arr in zip(actual_leaves, expected_leaves):
+        np.testing.assert_allclose(actual_arr, expected_arr)
 
   def test_tree_map_with_regex(self):
     d = {"this": 1, "that": {"another": 2, "wow": 3, "cool": {"neat": 4}}}
@@ -21,6 +21,7 @@ seeds.
 """
 
 import collections
+import concurrent.futures
 import os
 from typing import Dict
 
@@ -28,7 +29,6 @@ from absl import app
 from absl import flags
 from absl import logging
 import numpy as np
-import robustness_metrics as rm
 import tensorflow as tf
 
 import uncertainty_baselines as ub
@@ -157,27 +157,39 @@ def main(argv):
   logging.info('Ensemble number of weights: %s',
                ensemble_size * model.count_params())
   logging.info('Ensemble filenames: %s', str(ensemble_filenames))
-  checkpoint = tf.train.Checkpoint(model=model)
+
+  # Double-buffer the ensemble members: while member m is being evaluated,
+  # member m + 1 is restored into a second copy of the model in the
+  # background, hiding the checkpoint read behind inference.
+  models = [model]
+  if ensemble_size > 1:
+    models.append(
+        ub.models.bert_model(
+            num_classes=num_classes,
+            max_seq_length=feature_size,
+            bert_config=bert_config)[0])
+  checkpoints = [tf.train.Checkpoint(model=m) for m in models]
+
+  def restore_member(member):
+    checkpoints[member % len(models)].restore(
+        ensemble_filenames[member]).assert_existing_objects_matched()
+
+  restore_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+  next_restore = restore_executor.submit(restore_member, 0)
 
   # Write model predictions to files.
   num_datasets = len(test_datasets)
-  for m, ensemble_filename in enumerate(ensemble_filenames):
-    checkpoint.restore(ensemble_filename).assert_existing_objects_matched()
+  for m in range(ensemble_size):
+    next_restore.result()
+    if m + 1 < ensemble_size:
+      next_restore = restore_executor.submit(restore_member, m + 1)
+    model = models[m % len(models)]
     for n, (dataset_name, test_dataset) in enumerate(test_datasets.items()):
       filename = '{dataset}_{member}.npy'.format(dataset=dataset_name, member=m)
       filename = os.path.join(FLAGS.output_dir, filename)
       if not tf.io.gfile.exists(filename):
-        logits = []
-        test_iterator = iter(test_dataset)
-        for step in range(steps_per_eval[dataset_name]):
-          try:
-            inputs = next(test_iterator)
-          except StopIteration:
-            continue
-          features, labels, _ = utils.create_feature_and_label(inputs)
-          logits.append(model(features, training=False))
-
-        logits = tf.concat(logits, axis=0)
+        logits = utils.compute_member_logits(model, test_dataset,
+                                       steps_per_eval[dataset_name])
         with tf.io.gfile.GFile(filename, 'w') as f:
           np.save(f, logits.numpy())
       percent = (m * num_datasets + (n + 1)) / (ensemble_size * num_datasets)
@@ -185,6 +197,7 @@ def main(argv):
                  'Dataset {:d}/{:d}'.format(percent, m + 1, ensemble_size,
                                             n + 1, num_datasets))
       logging.info(message)
+  restore_executor.shutdown()
 
   metrics = utils.create_train_and_test_metrics(
       test_datasets,
@@ -239,15 +252,7 @@ def main(argv):
       features, labels, additional_labels = (
           utils.create_feature_and_label(inputs))
       logits = logits_dataset[:, (step * batch_size):((step + 1) * batch_size)]
-      loss_logits = tf.squeeze(logits, axis=-1)
-      negative_log_likelihood_metric = rm.metrics.EnsembleCrossEntropy(
-          binary=True)
-      negative_log_likelihood_metric.add_batch(loss_logits, labels=labels)
-      negative_log_likelihood = list(
-          negative_log_likelihood_metric.result().values())[0]
-
-      per_probs = tf.nn.sigmoid(logits)
-      probs = tf.reduce_mean(per_probs, axis=0)
+      negative_log_likelihood, probs = utils.ensemble_eval_step(logits, labels)
 
       ids_list.append(ids)
       texts_list.append(texts)
@@ -315,14 +320,14 @@ def main(argv):
         (n + 1) / num_datasets, n + 1, num_datasets))
     logging.info(message)
 
-    # record results
-    total_results = {}
-    for name, metric in metrics.items():
-      try:
-        total_results[name] = metric.result()
-      except tf.errors.InvalidArgumentError:
-        logging.info('Error for metric "%s". Recording 0.', name)
-        total_results[name] = 0
+  # record results
+  total_results = {}
+  for name, metric in metrics.items():
+    try:
+      total_results[name] = metric.result()
+    except tf.errors.InvalidArgumentError:
+      logging.info('Error for metric "%s". Recording 0.', name)
+      total_results[name] = 0
 
   # Metrics from Robustness Metrics (like ECE) will return a dict with a
   # single key/value, instead of a scalar.
@@ -34,7 +34,6 @@ from absl import flags
 from absl import logging
 import edward2 as ed
 import numpy as np
-import robustness_metrics as rm
 import tensorflow as tf
 
 import uncertainty_baselines as ub
@@ -284,15 +283,7 @@ def main(argv):
       features, labels, additional_labels = (
           utils.create_feature_and_label(inputs))
       logits = logits_dataset[:, (step * batch_size):((step + 1) * batch_size)]
-      loss_logits = tf.squeeze(logits, axis=-1)
-      negative_log_likelihood_metric = rm.metrics.EnsembleCrossEntropy(
-          binary=True)
-      negative_log_likelihood_metric.add_batch(loss_logits, labels=labels)
-      negative_log_likelihood = list(
-          negative_log_likelihood_metric.result().values())[0]
-
-      per_probs = tf.nn.sigmoid(logits)
-      probs = tf.reduce_mean(per_probs, axis=0)
+      negative_log_likelihood, probs = utils.ensemble_eval_step(logits, labels)
 
       ids_list.append(ids)
       texts_list.append(texts)
@@ -1008,6 +1008,73 @@ def make_test_metrics_update_fn(dataset_name,
   return update_fn
 
 
+@tf.function
+def ensemble_negative_log_likelihood(logits, labels):
+  """Computes the binary ensemble cross entropy of a batch.
+
+  Equivalent to `rm.metrics.EnsembleCrossEntropy(binary=True)`, i.e. the
+  negative log of the ensemble-averaged likelihood, but computed in a single
+  graph without constructing a new metric object for every batch.
+
+  Args:
+    logits: Tensor of shape [ensemble_size, batch_size] with per-member logits.
+    labels: Tensor of shape [batch_size] with the (binary) labels.
+
+  Returns:
+    Scalar Tensor, the ensemble negative log-likelihood averaged over the batch.
+  """
+  ensemble_size = tf.cast(tf.shape(logits)[0], logits.dtype)
+  labels = tf.broadcast_to(tf.cast(labels, logits.dtype)[tf.newaxis, ...],
+                           tf.shape(logits))
+  ce = tf.nn.sigmoid_cross_entropy_with_logits(labels=labels, logits=logits)
+  nll = -tf.reduce_logsumexp(-ce, axis=0) + tf.math.log(ensemble_size)
+  return tf.reduce_mean(nll)
+
+
+@tf.function(jit_compile=True)
+def ensemble_eval_step(logits, labels):
+  """Computes the ensemble NLL and predictive mean as one XLA cluster.
+
+  Args:
+    logits: Tensor of shape [ensemble_size, batch_size, 1] with per-member
+      logits.
+    labels: Tensor of shape [batch_size] with the (binary) labels.
+
+  Returns:
+    Tuple of the scalar ensemble negative log-likelihood, and the predictive
+    mean probabilities of shape [batch_size, 1].
+  """
+  negative_log_likelihood = ensemble_negative_log_likelihood(
+      tf.squeeze(logits, axis=-1), labels)
+  probs = tf.reduce_mean(tf.nn.sigmoid(logits), axis=0)
+  return negative_log_likelihood, probs
+
+
+@tf.function
+def compute_member_logits(member_model, test_dataset, num_steps):
+  """Runs one member over `num_steps` test batches and returns its logits.
+
+  The per-batch logits are written into a TensorArray inside a single
+  graph, instead of appending eager outputs to a list and concatenating.
+
+  Args:
+    member_model: the Keras model of the ensemble member.
+    test_dataset: the batched test dataset.
+    num_steps: number of batches to evaluate.
+
+  Returns:
+    Tensor of shape [num_examples, num_classes] with the member's logits.
+  """
+  logits = tf.TensorArray(
+      tf.float32, size=0, dynamic_size=True, infer_shape=False)
+  for step, inputs in test_dataset.take(num_steps).enumerate():
+    features, _, _ = create_feature_and_label(inputs)
+    batch_logits = member_model(features, training=False)
+    logits = logits.write(
+        tf.cast(step, tf.int32), tf.cast(batch_logits, tf.float32))
+  return logits.concat()
+
+
 def create_config(config_dir: str) -> configs.BertConfig:
   """Load a BERT config object from directory."""
   with tf.io.gfile.GFile(config_dir) as config_file:
@@ -14,6 +14,8 @@
 # limitations under the License.
 
 """Tests for utils."""
+import numpy as np
+import robustness_metrics as rm
 import tensorflow as tf
 import utils  # local file import from baselines.toxic_comments
 
@@ -41,6 +43,35 @@ class UtilsTest(tf.test.TestCase):
     self.assertListEqual(eval_folds, expected_eval_folds)
     self.assertListEqual(eval_fold_ids, expected_eval_fold_ids)
 
+  def test_ensemble_negative_log_likelihood(self):
+    ensemble_size, batch_size = 4, 16
+    logits = tf.random.normal((ensemble_size, batch_size), stddev=5.)
+    labels = tf.constant(
+        np.random.randint(2, size=batch_size), dtype=tf.float32)
+
+    expected_metric = rm.metrics.EnsembleCrossEntropy(binary=True)
+    expected_metric.add_batch(logits, labels=labels)
+    expected_nll = list(expected_metric.result().values())[0]
+
+    nll = utils.ensemble_negative_log_likelihood(logits, labels)
+    self.assertAllClose(nll, expected_nll, rtol=1e-5, atol=1e-5)
+
+  def test_ensemble_eval_step(self):
+    ensemble_size, batch_size = 4, 16
+    logits = tf.random.normal((ensemble_size, batch_size, 1), stddev=5.)
+    labels = tf.constant(
+        np.random.randint(2, size=batch_size), dtype=tf.float32)
+
+    nll, probs = utils.ensemble_eval_step(logits, labels)
+    self.assertAllClose(
+        nll,
+        utils.ensemble_negative_log_likelihood(
+            tf.squeeze(logits, axis=-1), labels),
+        rtol=1e-5, atol=1e-5)
+    self.assertAllClose(
+        probs, tf.reduce_mean(tf.nn.sigmoid(logits), axis=0),
+        rtol=1e-5, atol=1e-5)
+
 
 if __name__ == '__main__':
   tf.test.main()
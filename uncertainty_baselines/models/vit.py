@@ -167,6 +167,8 @@ class Encoder(nn.Module):
     num_heads: Number of heads in nn.MultiHeadDotProductAttention
     dropout_rate: dropout rate.
     attention_dropout_rate: dropout rate in self attention.
+    dtype: the dtype of the computation in the encoder blocks (default:
+      float32). The final layer norm, and hence the output, stays in float32.
   """
 
   num_layers: int
@@ -174,6 +176,7 @@ class Encoder(nn.Module):
   num_heads: int
   dropout_rate: float = 0.1
   attention_dropout_rate: float = 0.1
+  dtype: Dtype = jnp.float32
 
   @nn.compact
   def __call__(self, inputs, *, train):
@@ -201,7 +204,8 @@ class Encoder(nn.Module):
           dropout_rate=self.dropout_rate,
           attention_dropout_rate=self.attention_dropout_rate,
           name=f'encoderblock_{lyr}',
-          num_heads=self.num_heads)(
+          num_heads=self.num_heads,
+          dtype=self.dtype)(
               x, deterministic=not train)
     encoded = nn.LayerNorm(name='encoder_norm')(x)
 